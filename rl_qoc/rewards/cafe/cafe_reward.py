@@ -1,16 +1,21 @@
 from __future__ import annotations
 
 from dataclasses import dataclass, field
-from typing import List, Optional, Literal
+from functools import lru_cache, reduce
+from typing import Dict, List, Optional, Literal, Sequence, Tuple
 import numpy as np
 from qiskit import ClassicalRegister
-from qiskit.circuit import QuantumCircuit
+from qiskit.circuit import QuantumCircuit, Gate
 from qiskit.circuit.classical.types import Uint
+from qiskit.exceptions import QiskitError
 from qiskit.primitives import BaseSamplerV2
+from qiskit.quantum_info import Operator
+from qiskit_aer import AerSimulator
 
 from .cafe_reward_data import CAFERewardData, CAFERewardDataList
-from ..real_time_utils import handle_real_time_n_reps
+from ..real_time_utils import apply_real_time_n_reps, handle_real_time_n_reps
 from ...environment.target import GateTarget
+from ...environment.backend_info import BackendInfo
 from ...environment.configuration.qconfig import QEnvConfig
 from ..base_reward import Reward
 from ...helpers import validate_circuit_and_target
@@ -20,7 +25,111 @@ from ...helpers.circuit_utils import (
     get_input_states_cardinality_per_qubit,
     get_single_qubit_input_states,
 )
-from qiskit_aer import AerSimulator
+
+
+def _floyd_sample(uniforms: np.ndarray, n: int, k: int) -> np.ndarray:
+    """
+    Draw k distinct integers in [0, n) with Robert Floyd's algorithm (sorted in increasing order)
+
+    Args:
+        uniforms: k uniform draws in [0, 1) used as random source
+        n: Size of the population
+        k: Number of samples to draw (k <= n)
+    """
+    samples = set()
+    for j, u in zip(range(n - k, n), uniforms.tolist()):
+        t = int(u * (j + 1))
+        samples.add(j if t in samples else t)
+    return np.fromiter(sorted(samples), dtype=np.int64, count=k)
+
+
+def _circuit_key(qc: QuantumCircuit) -> Tuple:
+    """
+    Hashable key describing the structure of a circuit (instructions, parameters and qubits),
+    equal for copies of the same circuit
+
+    Args:
+        qc: Quantum circuit
+    """
+
+    def param_key(param):
+        if isinstance(param, QuantumCircuit):  # Control flow blocks
+            return _circuit_key(param)
+        if isinstance(param, np.ndarray):
+            return param.shape, param.tobytes()
+        return param
+
+    return (
+        qc.num_qubits,
+        qc.num_clbits,
+        tuple(
+            (
+                instruction.operation.name,
+                tuple(param_key(param) for param in instruction.operation.params),
+                tuple(qc.find_bit(qubit).index for qubit in instruction.qubits),
+                tuple(qc.find_bit(clbit).index for clbit in instruction.clbits),
+            )
+            for instruction in qc.data
+        ),
+    )
+
+
+def _bit_mask(bit_indices: Sequence[int], num_bits: int) -> np.ndarray:
+    """
+    Byte mask selecting the given bits in the packed (big-endian) representation of a BitArray
+
+    Args:
+        bit_indices: Indices of the bits to select
+        num_bits: Total number of bits in the BitArray
+    """
+    num_bytes = (num_bits + 7) // 8
+    mask = np.zeros(num_bytes, dtype=np.uint8)
+    for bit in bit_indices:
+        mask[num_bytes - 1 - bit // 8] |= 1 << (bit % 8)
+    return mask
+
+
+@lru_cache(maxsize=None)
+def _single_qubit_input_circuits(
+    input_states_choice: str,
+) -> Tuple[Tuple[QuantumCircuit, ...], Tuple[QuantumCircuit, ...]]:
+    """
+    Single qubit input state circuits (decomposed for Pauli input states) and their inverses.
+    Returned circuits are shared across calls and should not be modified in place.
+
+    Args:
+        input_states_choice: Type of input states (pauli4, pauli6, 2-design)
+    """
+    input_circuits = tuple(
+        circ.decompose() if input_states_choice in ["pauli4", "pauli6"] else circ
+        for circ in get_single_qubit_input_states(input_states_choice)
+    )
+    return input_circuits, tuple(input_circuit.inverse() for input_circuit in input_circuits)
+
+
+@lru_cache(maxsize=None)
+def _single_qubit_input_unitaries(input_states_choice: str) -> Tuple[np.ndarray, ...]:
+    """
+    Unitary matrices of the single qubit input state circuits
+
+    Args:
+        input_states_choice: Type of input states (pauli4, pauli6, 2-design)
+    """
+    input_circuits, _ = _single_qubit_input_circuits(input_states_choice)
+    return tuple(Operator(input_circuit).data for input_circuit in input_circuits)
+
+
+def _product_input_unitary(input_states_choice: str, input_indices: Sequence[int]) -> np.ndarray:
+    """
+    Unitary matrix of a product input state circuit, as the Kronecker product of the single qubit
+    input state unitaries (qubit 0 being the rightmost factor)
+
+    Args:
+        input_states_choice: Type of input states (pauli4, pauli6)
+        input_indices: Index of the single qubit input state for each qubit
+    """
+    single_qubit_unitaries = _single_qubit_input_unitaries(input_states_choice)
+    return reduce(np.kron, [single_qubit_unitaries[i] for i in reversed(input_indices)])
 
 
 @dataclass
@@ -32,9 +141,34 @@ class CAFEReward(Reward):
     input_states_choice: Literal["pauli4", "pauli6", "2-design"] = "pauli4"
     input_states_seed: int = 2000
     input_states_rng: np.random.Generator = field(init=False)
+    _inv_cache: Dict[Tuple, Operator | Tuple] = field(init=False, repr=False)
+    _run_cache: Dict[Tuple, QuantumCircuit] = field(init=False, repr=False)
+    _input_circuits: Dict[Tuple[str, int], Tuple[QuantumCircuit, ...]] = field(
+        init=False, repr=False
+    )
+    _unitary_sim: Optional[AerSimulator] = field(init=False, repr=False)
+    _prefetch_size: int = field(default=1 << 16, init=False, repr=False)
+    _prefetch_buf: np.ndarray = field(init=False, repr=False)
+    _prefetch_pos: int = field(init=False, repr=False)
 
     def __post_init__(self):
         self.input_states_rng = np.random.default_rng(self.input_states_seed)
+        self._reset_prefetch()
+        # Caches for unitaries and circuits reused across calls (keyed on circuit structure)
+        self._inv_cache = {}
+        self._run_cache = {}
+        self._input_circuits = {}
+        self._unitary_sim = None  # Created on first use (see unitary_simulator)
+
+    @property
+    def unitary_simulator(self) -> AerSimulator:
+        """
+        Aer simulator (unitary method) used to compute the ideal reference cycle unitaries,
+        shared across calls
+        """
+        if self._unitary_sim is None:
+            self._unitary_sim = AerSimulator(method="unitary")
+        return self._unitary_sim
 
     @property
     def reward_args(self):
@@ -50,6 +184,34 @@ class CAFEReward(Reward):
         """
         self.input_states_seed = seed + 357
         self.input_states_rng = np.random.default_rng(self.input_states_seed)
+        self._reset_prefetch()
+
+    def _reset_prefetch(self):
+        """
+        Discard the buffer of prefetched uniform draws of the input states random number generator
+        """
+        self._prefetch_buf = np.empty(0)
+        self._prefetch_pos = 0
+
+    def _draw_uniforms(self, k: int) -> np.ndarray:
+        """
+        Get the next k uniform draws in [0, 1) of the input states random number generator.
+        Draws are generated in blocks of size _prefetch_size, refilled when exhausted.
+
+        Args:
+            k: Number of draws
+        """
+        pos = self._prefetch_pos
+        if pos + k > self._prefetch_buf.size:
+            self._prefetch_buf = np.concatenate(
+                (
+                    self._prefetch_buf[pos:],
+                    self.input_states_rng.random(max(self._prefetch_size, k)),
+                )
+            )
+            pos = 0
+        self._prefetch_pos = pos + k
+        return self._prefetch_buf[pos : pos + k]
 
     def get_reward_data(
         self,
@@ -74,112 +236,181 @@ class CAFEReward(Reward):
         execution_config = env_config.execution_config
         backend_info = env_config.backend_info
 
-        if baseline_circuit is not None:
-            circuit_ref = baseline_circuit.copy()
-        else:
-            circuit_ref = qc.metadata["baseline_circuit"].copy()
+        if baseline_circuit is None:
+            baseline_circuit = qc.metadata["baseline_circuit"]
         layout = target.layout
-        num_qubits = target.causal_cone_size
-
-        input_states_samples = np.unique(
-            self.input_states_rng.choice(
-                len(target.input_states(self.input_states_choice)),
-                env_config.sampling_paulis,
-                replace=True,
-            ),
+        causal_cone_qubits = target.causal_cone_qubits
+        causal_cone_qubits_indices = target.causal_cone_qubits_indices
+        causal_cone_size = len(causal_cone_qubits)
+        n_reps = execution_config.current_n_reps
+        physical_qubits = tuple(target.physical_qubits)
+        # qc (and its baseline circuit in metadata) is a fresh copy of the environment circuit at
+        # each step: cached circuits are therefore keyed on the circuit structure, not identity
+        baseline_key = _circuit_key(baseline_circuit)
+        cycle_key = ("cycle", _circuit_key(qc), n_reps, physical_qubits)
+
+        # Input state circuits only depend on the input states choice and the causal cone size
+        input_states_key = (self.input_states_choice, causal_cone_size)
+        if input_states_key not in self._input_circuits:
+            self._input_circuits[input_states_key] = tuple(
+                input_state.circuit for input_state in target.input_states(self.input_states_choice)
+            )
+        input_circuits = self._input_circuits[input_states_key]
+        n_input_states = len(input_circuits)
+        input_states_shape = (
+            get_input_states_cardinality_per_qubit(self.input_states_choice),
+        ) * causal_cone_size
+        n_samples = min(env_config.sampling_paulis, n_input_states)
+        input_states_samples = _floyd_sample(
+            self._draw_uniforms(n_samples), n_input_states, n_samples
         )
-        reward_data = []
-        for sample in input_states_samples:
-            # for input_state in target.input_states:
-            input_state_indices = np.unravel_index(
+        inv_keys = {
+            sample: (
+                baseline_key,
+                n_reps,
+                physical_qubits,
+                self.input_states_choice,
                 sample,
-                (get_input_states_cardinality_per_qubit(self.input_states_choice),) * num_qubits,
             )
-            input_state = target.input_states(self.input_states_choice)[sample]
-            run_qc = qc.copy_empty_like(name="cafe_circ")  # Circuit with custom target gate
-            ref_qc = circuit_ref.copy_empty_like(
-                name="cafe_ref_circ"
-            )  # Circuit with reference gate
-
-            for circuit, context, control_flow in zip(
-                [run_qc, ref_qc],
-                [qc, circuit_ref],
-                [execution_config.control_flow_enabled, False],
-            ):
-                # Bind input states to the circuits
-                circuit.compose(
-                    input_state.circuit,
-                    qubits=target.causal_cone_qubits,
-                    inplace=True,
+            for sample in input_states_samples
+        }
+
+        # Reference unitaries (including input state) of samples that are not cached yet
+        uncached_samples = [
+            sample for sample in input_states_samples if inv_keys[sample] not in self._inv_cache
+        ]
+        sim_unitaries = {}
+        if uncached_samples:
+            # Unitary of the reference cycle circuit (restricted to the causal cone) is computed
+            # once, the input state unitary is then prepended for each sample
+            ref_key = ("cycle", baseline_key, n_reps)
+            if ref_key not in self._inv_cache:
+                cycle_operator = None
+                # Shortcut: when the reference circuit reduces to a single gate acting on the
+                # causal cone (e.g. target gate without context), its unitary is directly available
+                if (
+                    len(baseline_circuit.data) == 1
+                    and baseline_circuit.num_qubits == causal_cone_size
+                    and not baseline_circuit.parameters
+                    and isinstance(baseline_circuit.data[0].operation, Gate)
+                ):
+                    try:
+                        cycle_operator = Operator(baseline_circuit).power(n_reps)
+                    except QiskitError:  # Gate without matrix nor definition
+                        cycle_operator = None
+                if cycle_operator is None:
+                    ref_cycle_circuit = handle_n_reps(
+                        baseline_circuit, n_reps, backend_info.backend, control_flow=False
+                    )
+                    sim_qc = causal_cone_circuit(ref_cycle_circuit.decompose(), causal_cone_qubits)[
+                        0
+                    ]
+                    sim_qc.save_unitary()
+                    cycle_operator = self.unitary_simulator.run(sim_qc).result().get_unitary()
+                self._inv_cache[ref_key] = cycle_operator
+            cycle_operator = self._inv_cache[ref_key]
+            if self.input_states_choice in ["pauli4", "pauli6"]:
+                # Product input states: input state unitary is built from single qubit unitaries
+                cycle_matrix = cycle_operator.data
+                for sample in uncached_samples:
+                    input_unitary = _product_input_unitary(
+                        self.input_states_choice, np.unravel_index(sample, input_states_shape)
+                    )
+                    sim_unitaries[sample] = Operator(cycle_matrix @ input_unitary)
+            else:
+                for sample in uncached_samples:
+                    sim_unitaries[sample] = Operator(input_circuits[sample]).compose(cycle_operator)
+
+        qc_template = qc.copy_empty_like()
+
+        def build_reward_data(sample: int) -> CAFERewardData:
+            input_state_indices = np.unravel_index(sample, input_states_shape)
+            input_circuit = input_circuits[sample]
+
+            # Inverse unitary only depends on the reference circuit, input state and n_reps
+            # (transpiled first, as custom_transpile builds its pass manager on the first call)
+            inv_key = inv_keys[sample]
+            cached_inverse = self._inv_cache.get(inv_key)
+            if cached_inverse is None:
+                sim_unitary = sim_unitaries[sample]
+                reverse_unitary_qc = qc_template.copy()
+                reverse_unitary_qc.unitary(
+                    sim_unitary.adjoint(),  # Inverse unitary
+                    causal_cone_qubits,
+                    label="U_inv",
                 )
-                circuit.barrier()
-                cycle_circuit = handle_n_reps(
-                    context,
-                    execution_config.current_n_reps,
-                    backend_info.backend,
-                    control_flow=control_flow,
+                reverse_unitary_qc = backend_info.custom_transpile(
+                    reverse_unitary_qc,
+                    initial_layout=layout,
+                    scheduling=False,
+                    optimization_level=3,  # Find smallest circuit implementing inverse unitary
+                    remove_final_measurements=False,
                 )
-                circuit.compose(cycle_circuit, inplace=True)
-
-            # Compute inverse unitary for reference circuit
-            sim_qc = causal_cone_circuit(ref_qc.decompose(), target.causal_cone_qubits)[0]
-            sim_qc.save_unitary()
-            backend = (
-                backend_info.backend
-                if isinstance(backend_info.backend, AerSimulator)
-                else AerSimulator()
-            )
-            sim_unitary = (
-                backend.run(sim_qc, noise_model=None, method="unitary").result().get_unitary()
-            )
-
-            reverse_unitary_qc = QuantumCircuit.copy_empty_like(run_qc)
-            reverse_unitary_qc.unitary(
-                sim_unitary.adjoint(),  # Inverse unitary
-                target.causal_cone_qubits,
-                label="U_inv",
-            )
-            reverse_unitary_qc = backend_info.custom_transpile(
-                reverse_unitary_qc,
-                initial_layout=layout,
-                scheduling=False,
-                optimization_level=3,  # Find smallest circuit implementing inverse unitary
-                remove_final_measurements=False,
+                # Restriction of the inverse circuit to the causal cone is stored alongside it
+                if reverse_unitary_qc.num_qubits != causal_cone_size:
+                    cone_reverse_qc = causal_cone_circuit(reverse_unitary_qc, physical_qubits)[0]
+                else:
+                    cone_reverse_qc = reverse_unitary_qc
+                cached_inverse = (reverse_unitary_qc, cone_reverse_qc)
+                self._inv_cache[inv_key] = cached_inverse
+            reverse_unitary_qc, cone_reverse_qc = cached_inverse
+
+            # Input state preparation is separated from the cycle circuit by a barrier,
+            # so it can be transpiled on its own and prepended to the cached cycle circuit
+            input_key = (
+                "input",
+                physical_qubits,
+                tuple(causal_cone_qubits_indices),
+                qc.num_qubits,
+                self.input_states_choice,
+                sample,
             )
+            input_qc = self._run_cache.get(input_key)
+            if input_qc is None:
+                input_qc = qc_template.copy(name="cafe_input_circ")
+                input_qc.compose(input_circuit, qubits=causal_cone_qubits, inplace=True)
+                input_qc.barrier()
+                input_qc = backend_info.custom_transpile(
+                    input_qc, initial_layout=layout, scheduling=False
+                )
+                self._run_cache[input_key] = input_qc
+
+            # Transpiled cycle circuit (without input state) is shared by all samples
+            cycle_qc = self._run_cache.get(cycle_key)
+            if cycle_qc is None:
+                cycle_qc = qc_template.copy(name="cafe_circ")
+                cycle_qc.compose(
+                    handle_n_reps(
+                        qc,
+                        n_reps,
+                        backend_info.backend,
+                        control_flow=execution_config.control_flow_enabled,
+                    ),
+                    inplace=True,
+                )
+                cycle_qc = backend_info.custom_transpile(
+                    cycle_qc, initial_layout=layout, scheduling=False
+                )
+                cycle_qc.barrier()
+                self._run_cache[cycle_key] = cycle_qc
 
-            # Bind inverse unitary + measurement to run circuit
-            transpiled_circuit = backend_info.custom_transpile(
-                run_qc, initial_layout=layout, scheduling=False
-            )
-            transpiled_circuit.barrier()
+            # Prepend input state to the cycle circuit
+            transpiled_circuit = cycle_qc.compose(input_qc, front=True)
             # Add the inverse unitary + measurement to the circuit
             transpiled_circuit.compose(reverse_unitary_qc, inplace=True)
             transpiled_circuit.measure_all()
 
             pub = (transpiled_circuit, params, execution_config.n_shots)
-            reward_data.append(
-                CAFERewardData(
-                    pub,
-                    input_state.circuit,
-                    execution_config.current_n_reps,
-                    input_state_indices,
-                    (
-                        causal_cone_circuit(reverse_unitary_qc, target.physical_qubits)[0]
-                        if reverse_unitary_qc.num_qubits != target.causal_cone_size
-                        else reverse_unitary_qc
-                    ),
-                    target.causal_cone_qubits_indices,
-                )
+            return CAFERewardData(
+                pub,
+                input_circuit,
+                n_reps,
+                input_state_indices,
+                cone_reverse_qc,
+                causal_cone_qubits_indices,
             )
-            # for circ, pubs_ in zip([run_qc, ref_qc], [pubs, ideal_pubs]):
-            #     transpiled_circuit = backend_info.custom_transpile(
-            #         circ, initial_layout=layout, scheduling=False
-            #     )
-            #     transpiled_circuit.barrier()
-            #     # Add the inverse unitary + measurement to the circuit
-            #     transpiled_circuit.compose(reverse_unitary_qc, inplace=True)
-            #     transpiled_circuit.measure_all()
-            #     pubs_.append((transpiled_circuit, params, execution_config.n_shots))
+
+        reward_data = [build_reward_data(sample) for sample in input_states_samples]
 
         return CAFERewardDataList(reward_data)
 
@@ -191,45 +422,30 @@ class CAFEReward(Reward):
         """
         Compute the reward based on the input pubs
         """
-        job = primitive.run(reward_data.pubs)
+        pubs = reward_data.pubs
+        job = primitive.run(pubs)
         causal_cone_qubits_indices = reward_data.causal_cone_qubits_indices
-        causal_cone_size = reward_data.causal_cone_size
         pub_results = job.result()
-        batch_size = reward_data.pubs[0].parameter_values.shape[0]
-        n_shots = reward_data.pubs[0].shots
-        assert all(
-            [pub.shots == n_shots for pub in reward_data.pubs]
-        ), "All pubs should have the same number of shots"
-        assert all(
-            [pub.parameter_values.shape[0] == batch_size for pub in reward_data.pubs]
-        ), "All pubs should have the same batch size"
-        num_bits = pub_results[0].data.meas[0].num_bits
-        if num_bits == causal_cone_size:
-            # No post-selection based on causal cone
-            pub_data = [
-                [pub_result.data.meas[i] for i in range(batch_size)] for pub_result in pub_results
-            ]
-            survival_probability = [
-                [bit_array.get_int_counts().get(0, 0) / n_shots for bit_array in bit_arrays]
-                for bit_arrays in pub_data
-            ]
-        else:
+        shots = reward_data.shots_array
+        batch_sizes = reward_data.batch_size_array
+        n_shots = int(shots[0])
+        batch_size = int(batch_sizes[0])
+        assert np.all(shots == n_shots), "All pubs should have the same number of shots"
+        assert np.all(batch_sizes == batch_size), "All pubs should have the same batch size"
+        survival_counts = np.empty((len(pub_results), batch_size), dtype=np.float64)
+        if reward_data.needs_postselect:
             # Post-select based on causal cone qubits
-            pub_data = [
-                [
-                    pub_result.data.meas[i].postselect(
-                        causal_cone_qubits_indices,
-                        [0] * causal_cone_size,
-                    )
-                    for i in range(batch_size)
-                ]
-                for pub_result in pub_results
-            ]
-            survival_probability = [
-                [bit_array.num_shots / n_shots for bit_array in bit_arrays]
-                for bit_arrays in pub_data
-            ]
-        reward = np.mean(survival_probability, axis=0)
+            mask = _bit_mask(causal_cone_qubits_indices, pub_results[0].data.meas.num_bits)
+        for p, pub_result in enumerate(pub_results):
+            # Count shots for which all (selected) bits are 0 directly on the packed bit array
+            # (shape: (batch_size, n_shots, n_bytes))
+            bits = pub_result.data.meas.array
+            if reward_data.needs_postselect:
+                bits = bits & mask
+            survival_counts[p] = np.count_nonzero(~np.any(bits, axis=-1), axis=-1).reshape(
+                batch_size
+            )
+        reward = survival_counts.mean(axis=0) * (1.0 / n_shots)
         return reward
 
     def get_real_time_circuit(
@@ -252,24 +468,25 @@ class CAFEReward(Reward):
         qc.reset(qc.qubits)
         num_qubits = qc.num_qubits
         all_n_reps = execution_config.n_reps
+        causal_cone_qubits = target.causal_cone_qubits
+        causal_cone_size = len(causal_cone_qubits)
+        layout = target.layout
         n_reps = execution_config.current_n_reps
 
         n_reps_var = qc.add_input("n_reps", Uint(8)) if len(all_n_reps) > 1 else n_reps
         if not qc.clbits:
-            meas = ClassicalRegister(target.causal_cone_size, name="meas")
+            meas = ClassicalRegister(causal_cone_size, name="meas")
             qc.add_register(meas)
         else:
             meas = qc.cregs[0]
-            if meas.size != target.causal_cone_size:
+            if meas.size != causal_cone_size:
                 raise ValueError("Classical register size must match the target causal cone size")
 
         input_state_vars = [qc.add_input(f"input_state_{i}", Uint(8)) for i in range(num_qubits)]
 
-        input_choice = self.input_states_choice
-        input_circuits = [
-            circ.decompose() if input_choice in ["pauli4", "pauli6"] else circ
-            for circ in get_single_qubit_input_states(input_choice)
-        ]
+        input_circuits, input_state_inverses = _single_qubit_input_circuits(
+            self.input_states_choice
+        )
 
         for q, qubit in enumerate(qc.qubits):
             # Input state prep (over all qubits of the circuit context)
@@ -281,45 +498,39 @@ class CAFEReward(Reward):
                         else:
                             qc.delay(16, qubit)
 
-        if len(prep_circuits) > 1:  # Switch over possible contexts
-            circuit_choice = qc.add_input("circuit_choice", Uint(8))
-            with qc.switch(circuit_choice) as case_circuit:
-                for i, prep_circuit in enumerate(prep_circuits):
-                    with case_circuit(i):
-                        handle_real_time_n_reps(all_n_reps, n_reps_var, prep_circuit, qc)
-        else:
-            handle_real_time_n_reps(all_n_reps, n_reps_var, prep_circuits[0], qc)
-
-        # Inversion step: compute the ideal reverse unitaries
-        ref_circuits = [circ.metadata.get("baseline_circuit", None) for circ in prep_circuits]
-        cycle_circuit_inverses = [[] for _ in range(len(ref_circuits))]
-        input_state_inverses = [input_circuit.inverse() for input_circuit in input_circuits]
-        for i, ref_circ in enumerate(ref_circuits):
+        if len(prep_circuits) == 1 and len(all_n_reps) == 1:
+            # Single context and single number of repetitions: no switch over circuit choice or
+            # n_reps is needed, the cycle circuit and its inverse are composed unconditionally
+            prep_circuit = prep_circuits[0]
+            ref_circ = prep_circuit.metadata.get("baseline_circuit", None)
             if ref_circ is None:
                 raise ValueError("Baseline circuit not found in metadata")
-            for n in all_n_reps:
-                cycle_circuit, _ = causal_cone_circuit(
-                    ref_circ.repeat(n).decompose(), target.causal_cone_qubits
-                )
-                cycle_circuit.save_unitary()
-                sim_unitary = (
-                    AerSimulator(method="unitary").run(cycle_circuit).result().get_unitary()
-                )
-                inverse_circuit = ref_circ.copy_empty_like(name="inverse_circuit")
-                inverse_circuit.unitary(
-                    sim_unitary.adjoint(),  # Inverse unitary
-                    target.causal_cone_qubits,
-                    label="U_inv",
-                )
-                inverse_circuit = backend_info.custom_transpile(
-                    inverse_circuit,
-                    initial_layout=target.layout,
-                    scheduling=False,
-                    optimization_level=3,  # Find smallest circuit implementing inverse unitary
-                    remove_final_measurements=False,
-                )
-                inverse_circuit, _ = causal_cone_circuit(inverse_circuit, target.physical_qubits)
-                cycle_circuit_inverses[i].append(inverse_circuit)
+            apply_real_time_n_reps(n_reps, qc, prep_circuit)
+            inverse_circuit = self._real_time_cycle_inverse(ref_circ, n_reps, target, backend_info)
+            if inverse_circuit.data:
+                qc.compose(inverse_circuit, causal_cone_qubits, inplace=True)
+            else:
+                qc.delay(16, causal_cone_qubits)
+        else:
+            if len(prep_circuits) > 1:  # Switch over possible contexts
+                circuit_choice = qc.add_input("circuit_choice", Uint(8))
+                with qc.switch(circuit_choice) as case_circuit:
+                    for i, prep_circuit in enumerate(prep_circuits):
+                        with case_circuit(i):
+                            handle_real_time_n_reps(all_n_reps, n_reps_var, prep_circuit, qc)
+            else:
+                handle_real_time_n_reps(all_n_reps, n_reps_var, prep_circuits[0], qc)
+
+            # Inversion step: compute the ideal reverse unitaries
+            ref_circuits = [circ.metadata.get("baseline_circuit", None) for circ in prep_circuits]
+            cycle_circuit_inverses = [[] for _ in range(len(ref_circuits))]
+            for i, ref_circ in enumerate(ref_circuits):
+                if ref_circ is None:
+                    raise ValueError("Baseline circuit not found in metadata")
+                for n in all_n_reps:
+                    cycle_circuit_inverses[i].append(
+                        self._real_time_cycle_inverse(ref_circ, n, target, backend_info)
+                    )
 
             # Add the inverse unitary that matches the combo of circuit choice and n_reps
             if len(prep_circuits) > 1:
@@ -333,54 +544,45 @@ class CAFEReward(Reward):
                                             if inverse_circuit[j].data:
                                                 qc.compose(
                                                     inverse_circuit[j],
-                                                    target.causal_cone_qubits,
+                                                    causal_cone_qubits,
                                                     inplace=True,
                                                 )
                                             else:
-                                                qc.delay(16, target.causal_cone_qubits)
+                                                qc.delay(16, causal_cone_qubits)
                             else:
                                 if inverse_circuit[0].data:
                                     qc.compose(
                                         inverse_circuit[0],
-                                        target.causal_cone_qubits,
+                                        causal_cone_qubits,
                                         inplace=True,
                                     )
                                 else:
-                                    qc.delay(16, target.causal_cone_qubits)
+                                    qc.delay(16, causal_cone_qubits)
             else:
-                if len(all_n_reps) > 1:
-                    with qc.switch(n_reps_var) as case_n_reps:
-                        for j, n in enumerate(all_n_reps):
-                            with case_n_reps(n):
-                                if cycle_circuit_inverses[0][j].data:
-                                    qc.compose(
-                                        cycle_circuit_inverses[0][j],
-                                        target.causal_cone_qubits,
-                                        inplace=True,
-                                    )
-                                else:
-                                    qc.delay(16, target.causal_cone_qubits)
-                else:
-                    if cycle_circuit_inverses[0][0].data:
-                        qc.compose(
-                            cycle_circuit_inverses[0][0],
-                            target.causal_cone_qubits,
-                            inplace=True,
-                        )
-                    else:
-                        qc.delay(16, target.causal_cone_qubits)
-
-            # Revert the input state prep
-            for q, qubit in enumerate(target.causal_cone_qubits):
-                with qc.switch(input_state_vars[q]) as case_input_state:
-                    for i, input_circuit in enumerate(input_state_inverses):
-                        with case_input_state(i):
-                            if input_circuit.data:
-                                qc.compose(input_circuit, qubit, inplace=True)
+                with qc.switch(n_reps_var) as case_n_reps:
+                    for j, n in enumerate(all_n_reps):
+                        with case_n_reps(n):
+                            if cycle_circuit_inverses[0][j].data:
+                                qc.compose(
+                                    cycle_circuit_inverses[0][j],
+                                    causal_cone_qubits,
+                                    inplace=True,
+                                )
                             else:
-                                qc.delay(16, qubit)
+                                qc.delay(16, causal_cone_qubits)
+
+        # Revert the input state prep
+        for q, qubit in enumerate(causal_cone_qubits):
+            with qc.switch(input_state_vars[q]) as case_input_state:
+                for i, input_circuit in enumerate(input_state_inverses):
+                    with case_input_state(i):
+                        if input_circuit.data:
+                            qc.compose(input_circuit, qubit, inplace=True)
+                        else:
+                            qc.delay(16, qubit)
+
         # Measure the causal cone qubits
-        qc.measure(target.causal_cone_qubits, meas)
+        qc.measure(causal_cone_qubits, meas)
 
         if skip_transpilation:
             return qc
@@ -388,7 +590,46 @@ class CAFEReward(Reward):
         return backend_info.custom_transpile(
             qc,
             optimization_level=1,
+            initial_layout=layout,
+            scheduling=False,
+            remove_final_measurements=False,
+        )
+
+    def _real_time_cycle_inverse(
+        self,
+        ref_circ: QuantumCircuit,
+        n_reps: int,
+        target: GateTarget,
+        backend_info: BackendInfo,
+    ) -> QuantumCircuit:
+        """
+        Compute the transpiled circuit implementing the inverse of the ideal reference cycle
+        (repeated n_reps times), restricted to the causal cone of the target
+
+        Args:
+            ref_circ: Reference (baseline) circuit
+            n_reps: Number of repetitions of the reference circuit
+            target: Target gate
+            backend_info: Backend information used for transpilation
+        """
+        causal_cone_qubits = target.causal_cone_qubits
+        cycle_circuit, _ = causal_cone_circuit(
+            ref_circ.repeat(n_reps).decompose(), causal_cone_qubits
+        )
+        cycle_circuit.save_unitary()
+        sim_unitary = self.unitary_simulator.run(cycle_circuit).result().get_unitary()
+        inverse_circuit = ref_circ.copy_empty_like(name="inverse_circuit")
+        inverse_circuit.unitary(
+            sim_unitary.adjoint(),  # Inverse unitary
+            causal_cone_qubits,
+            label="U_inv",
+        )
+        inverse_circuit = backend_info.custom_transpile(
+            inverse_circuit,
             initial_layout=target.layout,
             scheduling=False,
+            optimization_level=3,  # Find smallest circuit implementing inverse unitary
             remove_final_measurements=False,
         )
+        inverse_circuit, _ = causal_cone_circuit(inverse_circuit, target.physical_qubits)
+        return inverse_circuit
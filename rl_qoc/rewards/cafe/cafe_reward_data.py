@@ -1,7 +1,8 @@
 from __future__ import annotations
 
 from ..reward_data import RewardData, RewardDataList
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+import numpy as np
 from typing import Optional, Tuple, List
 from qiskit.circuit import QuantumCircuit
 from qiskit.primitives.containers.sampler_pub import SamplerPub, SamplerPubLike
@@ -58,6 +59,8 @@ class CAFERewardDataList(RewardDataList):
     """
 
     reward_data: List[CAFERewardData]
+    # Whether measurement outcomes should be post-selected on the causal cone qubits
+    needs_postselect: bool = field(init=False)
 
     def __post_init__(self):
         # Check if all reward data have the same number of qubits
@@ -78,13 +81,40 @@ class CAFERewardDataList(RewardDataList):
                 raise ValueError(
                     f"Causal cone qubits indices in input circuit ({causal_cone_qubits_indices}) does not match number of qubits in reward data ({reward_data.causal_cone_qubits_indices})"
                 )
+        # Pubs fields gathered in contiguous arrays for the reward computation
+        self._pubs = tuple(reward_data.pub for reward_data in self.reward_data)
+        self._shots = np.fromiter(
+            (pub.shots for pub in self._pubs), dtype=np.int64, count=len(self._pubs)
+        )
+        self._batch_sizes = np.fromiter(
+            (pub.parameter_values.shape[0] for pub in self._pubs),
+            dtype=np.int64,
+            count=len(self._pubs),
+        )
+        # All qubits of the pub circuits are measured: post-selection is needed whenever the
+        # circuits span more qubits than the causal cone
+        self.needs_postselect = self._pubs[0].circuit.num_qubits != self.causal_cone_size
 
     @property
     def pubs(self) -> List[SamplerPub]:
         """
         Return the list of SamplerPubs.
         """
-        return [SamplerPub.coerce(reward_data.pub) for reward_data in self.reward_data]
+        return list(self._pubs)
+
+    @property
+    def shots_array(self) -> np.ndarray:
+        """
+        Return the number of shots of each pub as an array.
+        """
+        return self._shots
+
+    @property
+    def batch_size_array(self) -> np.ndarray:
+        """
+        Return the batch size (number of parameter values) of each pub as an array.
+        """
+        return self._batch_sizes
 
     @property
     def causal_cone_qubits_indices(self) -> List[int]:
@@ -105,17 +135,14 @@ class CAFERewardDataList(RewardDataList):
         """
         Return the number of shots.
         """
-        return [reward_data.shots for reward_data in self.reward_data]
+        return self._shots.tolist()
 
     @property
     def total_shots(self) -> int:
         """
         Return the total number of shots.
         """
-        return sum(
-            reward_data.shots * reward_data.pub.parameter_values.shape[0]
-            for reward_data in self.reward_data
-        )
+        return int(np.dot(self._shots, self._batch_sizes))
 
     @property
     def n_reps(self) -> int:
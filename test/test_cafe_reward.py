@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+from gymnasium.spaces import Box
+from qiskit.circuit import ParameterVector
+from qiskit.primitives import BitArray
+from qiskit.providers.fake_provider import GenericBackendV2
+from qiskit.quantum_info import Operator
+
+from rl_qoc.environment.configuration.backend_config import QiskitConfig
+from rl_qoc.environment.configuration.execution_config import ExecutionConfig
+from rl_qoc.environment.configuration.qconfig import QEnvConfig
+from rl_qoc.environment.target import GateTarget
+from rl_qoc.helpers.circuit_utils import get_input_states_cardinality_per_qubit
+from rl_qoc.rewards import CAFEReward
+from rl_qoc.rewards.cafe.cafe_reward import _bit_mask, _product_input_unitary
+
+
+def _cafe_env_config(input_states_choice="pauli4"):
+    target = GateTarget("cx", physical_qubits=[0, 1])
+    execution_config = ExecutionConfig(
+        batch_size=2, sampling_paulis=16, n_shots=10, n_reps=1, seed=3
+    )
+    return QEnvConfig(
+        target,
+        QiskitConfig(backend=GenericBackendV2(3, seed=1)),
+        Box(-1, 1, (1,)),
+        execution_config,
+        reward=CAFEReward(input_states_choice=input_states_choice),
+    )
+
+
+def _parametrized_circuit(target):
+    params = ParameterVector("th", 1)
+    qc = target.circuit.copy_empty_like()
+    qc.compose(target.circuit, inplace=True)
+    qc.rz(params[0], 0)
+    qc.metadata["baseline_circuit"] = target.circuit
+    return qc
+
+
+def test_cafe_reward_caches_do_not_grow_with_circuit_copies():
+    # The environment passes a fresh copy of its circuit at each step
+    env_config = _cafe_env_config()
+    reward, target = env_config.reward, env_config.target
+    qc = _parametrized_circuit(target)
+    params = np.zeros((2, 1))
+
+    # All 16 input states are sampled at each call, so every cache entry exists after the first
+    reward.get_reward_data(qc.copy(), params, target, env_config)
+    cache_sizes = len(reward._inv_cache), len(reward._run_cache)
+
+    for _ in range(5):
+        reward.get_reward_data(qc.copy(), params, target, env_config)
+    assert (len(reward._inv_cache), len(reward._run_cache)) == cache_sizes
+
+
+def test_bit_mask_matches_postselect():
+    num_bits, num_shots = 13, 200
+    causal_cone_indices = [0, 3, 9, 12]
+    rng = np.random.default_rng(0)
+    bit_array = BitArray.from_bool_array(rng.integers(0, 2, (num_shots, num_bits), dtype=bool))
+
+    mask = _bit_mask(causal_cone_indices, num_bits)
+    survival_count = np.count_nonzero(~np.any(bit_array.array & mask, axis=-1))
+
+    postselected = bit_array.postselect(causal_cone_indices, [0] * len(causal_cone_indices))
+    assert survival_count == postselected.num_shots
+
+
+@pytest.mark.parametrize("input_states_choice", ["pauli4", "pauli6"])
+def test_product_input_unitary_matches_input_state_circuit(input_states_choice):
+    target = GateTarget("cx", physical_qubits=[0, 1])
+    cardinality = get_input_states_cardinality_per_qubit(input_states_choice)
+    input_states = target.input_states(input_states_choice)
+    for sample, input_state in enumerate(input_states):
+        input_indices = np.unravel_index(sample, (cardinality,) * target.causal_cone_size)
+        assert Operator(_product_input_unitary(input_states_choice, input_indices)) == Operator(
+            input_state.circuit
+        )